@@ -0,0 +1,58 @@
+"""initial schema (tables as previously created by create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-15
+
+Databases created by the old startup create_all already match this
+revision: run `alembic stamp 0001` once, then `alembic upgrade head`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "plans",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.Text(), nullable=False),
+        sa.Column("duration_days", sa.Integer(), nullable=True),
+        sa.Column("price", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_plans_id", "plans", ["id"])
+
+    op.create_table(
+        "licenses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("license_key", sa.Text(), nullable=False),
+        sa.Column("owner", sa.Text(), nullable=True),
+        sa.Column("plan", sa.Text(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("max_activations", sa.Integer(), nullable=True),
+        sa.Column("active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_licenses_id", "licenses", ["id"])
+    op.create_index("ix_licenses_license_key", "licenses", ["license_key"], unique=True)
+
+    op.create_table(
+        "activations",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("license_id", sa.Integer(), nullable=False),
+        sa.Column("device_id", sa.Text(), nullable=True),
+        sa.Column("device_fingerprint", sa.Text(), nullable=True),
+        sa.Column("ip", sa.Text(), nullable=True),
+        sa.Column("last_seen", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_activations_id", "activations", ["id"])
+
+def downgrade():
+    op.drop_table("activations")
+    op.drop_table("licenses")
+    op.drop_table("plans")
@@ -0,0 +1,19 @@
+"""index activations on (license_id, device_id)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-15
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # may already exist: created by hand, or by create_all before alembic
+    op.create_index("ix_activations_license_device", "activations", ["license_id", "device_id"], if_not_exists=True)
+
+def downgrade():
+    op.drop_index("ix_activations_license_device", table_name="activations")
@@ -0,0 +1,23 @@
+"""add licenses.expires_at_epoch (unix seconds) for cheap expiry checks
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-15
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("licenses", sa.Column("expires_at_epoch", sa.BigInteger(), nullable=True))
+    op.execute(
+        "UPDATE licenses SET expires_at_epoch = EXTRACT(EPOCH FROM expires_at)::bigint "
+        "WHERE expires_at IS NOT NULL"
+    )
+
+def downgrade():
+    op.drop_column("licenses", "expires_at_epoch")
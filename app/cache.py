@@ -0,0 +1,217 @@
+# app/cache.py
+# Optional Redis cache in front of hot license reads
+import os
+import asyncio
+import orjson
+import time
+import redis.asyncio as redis
+
+REDIS_URL = os.environ.get("REDIS_URL")  # e.g. redis://localhost:6379/0
+LICENSE_CACHE_TTL = int(os.environ.get("LICENSE_CACHE_TTL", "60"))  # seconds
+
+# Caching is skipped entirely when REDIS_URL is not set. Configure the Redis
+# server with maxmemory and `maxmemory-policy allkeys-lfu` so hot keys stay.
+redis_client = redis.from_url(REDIS_URL) if REDIS_URL else None
+
+def license_cache_key(license_key: str) -> str:
+    return f"lic:{license_key}"
+
+async def get_cached_license(license_key: str) -> dict | None:
+    if redis_client is None:
+        return None
+    try:
+        raw = await redis_client.get(license_cache_key(license_key))
+    except redis.RedisError:
+        return None
+    return orjson.loads(raw) if raw else None
+
+async def set_cached_license(license_key: str, data: dict):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.setex(license_cache_key(license_key), LICENSE_CACHE_TTL, orjson.dumps(data))
+    except redis.RedisError:
+        pass
+
+async def invalidate_license(license_key: str):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(license_cache_key(license_key))
+    except redis.RedisError:
+        pass
+
+# Whole-response cache for stale-tolerant admin listings, stored as a hash
+# {body, generated_at, stale_at}. The snapshot outlives stale_at so it can
+# still be served when the database is unavailable.
+ADMIN_LIST_CACHE_KEY = "cache:admin:list_licenses"
+ADMIN_LIST_CACHE_TTL = int(os.environ.get("ADMIN_LIST_CACHE_TTL", "15"))  # seconds
+RESPONSE_CACHE_KEEP = int(os.environ.get("RESPONSE_CACHE_KEEP", "86400"))  # seconds
+
+async def get_cached_response(key: str) -> tuple[bytes, bool] | None:
+    """Return (body, fresh) or None"""
+    if redis_client is None:
+        return None
+    try:
+        body, stale_at = await redis_client.hmget(key, "body", "stale_at")
+    except redis.RedisError:
+        return None
+    if body is None:
+        return None
+    return body, float(stale_at or 0) > time.time()
+
+async def set_cached_response(key: str, body: bytes, ttl: int):
+    if redis_client is None:
+        return
+    now = time.time()
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"body": body, "generated_at": now, "stale_at": now + ttl})
+            pipe.expire(key, RESPONSE_CACHE_KEEP)
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+async def expire_cached_response(key: str):
+    # mark stale rather than delete, keeping the snapshot as a fallback
+    if redis_client is None:
+        return
+    try:
+        await redis_client.hset(key, "stale_at", 0)
+    except redis.RedisError:
+        pass
+
+# Negative-lookup filter in front of the database: a RedisBloom filter of every
+# issued license key plus a plain set of killed keys. A missing or dirty filter
+# (no RedisBloom, not built yet, a failed insert, Redis down) means "maybe",
+# never "no", and schedules a rebuild. The filter also expires after
+# LICENSE_FILTER_MAX_AGE, which bounds how long keys written behind the
+# server's back (CLI without REDIS_URL, a crash before the insert) stay missing.
+LICENSE_FILTER_KEY = "activekeys"
+LICENSE_FILTER_BUILD_KEY = "activekeys:build"
+LICENSE_FILTER_LOCK_KEY = "activekeys:lock"
+LICENSE_FILTER_DIRTY_KEY = "activekeys:dirty"
+KILLED_KEYS_SET = "killed_keys"
+LICENSE_FILTER_ERROR_RATE = 0.001
+LICENSE_FILTER_CAPACITY = int(os.environ.get("LICENSE_FILTER_CAPACITY", "1000000"))
+LICENSE_FILTER_MAX_AGE = int(os.environ.get("LICENSE_FILTER_MAX_AGE", "3600"))  # seconds
+LICENSE_FILTER_RETRY = 30  # seconds between rebuild attempts from one process
+FILTER_BATCH = 1000
+
+_license_loader = None  # set by rebuild_license_filter, reused for repairs
+_rebuild_task: asyncio.Task | None = None
+_last_rebuild = 0.0
+# a filter insert failed and Redis could not be told either; retried on next check
+_filter_repair_pending = False
+
+def _schedule_rebuild():
+    global _rebuild_task, _last_rebuild
+    if _license_loader is None or (_rebuild_task is not None and not _rebuild_task.done()):
+        return
+    if time.monotonic() - _last_rebuild < LICENSE_FILTER_RETRY:
+        return
+    _last_rebuild = time.monotonic()
+    _rebuild_task = asyncio.create_task(rebuild_license_filter(_license_loader))
+
+async def _mark_filter_dirty():
+    global _filter_repair_pending
+    try:
+        await redis_client.set(LICENSE_FILTER_DIRTY_KEY, 1)
+        _filter_repair_pending = False
+    except redis.RedisError:
+        _filter_repair_pending = True
+
+async def check_license_filter(license_key: str) -> tuple[bool, bool]:
+    """Return (may_exist, killed)"""
+    if redis_client is None:
+        return True, False
+    if _filter_repair_pending:
+        await _mark_filter_dirty()
+        if _filter_repair_pending:
+            return True, False
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.exists(LICENSE_FILTER_KEY)
+            pipe.exists(LICENSE_FILTER_DIRTY_KEY)
+            pipe.execute_command("BF.EXISTS", LICENSE_FILTER_KEY, license_key)
+            pipe.sismember(KILLED_KEYS_SET, license_key)
+            has_filter, dirty, in_filter, killed = await pipe.execute()
+    except redis.RedisError:
+        return True, False
+    if not has_filter or dirty:
+        _schedule_rebuild()
+        return True, bool(killed)
+    return bool(in_filter), bool(killed)
+
+async def add_license_keys(license_keys: list[str]):
+    if redis_client is None or not license_keys:
+        return
+    # also feed a rebuild in progress so keys created meanwhile are not lost.
+    # Build filter first: if the rebuild renames it in between, the second
+    # insert lands in the renamed filter instead of missing both.
+    for key in (LICENSE_FILTER_BUILD_KEY, LICENSE_FILTER_KEY):
+        try:
+            await redis_client.execute_command("BF.INSERT", key, "NOCREATE", "ITEMS", *license_keys)
+        except redis.RedisError as e:
+            if isinstance(e, redis.ResponseError) and "not found" in str(e).lower():
+                continue  # this filter does not exist
+            # the filter may now be missing keys: stop trusting it until rebuilt
+            await _mark_filter_dirty()
+            return
+
+async def mark_license_killed(license_key: str):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.sadd(KILLED_KEYS_SET, license_key)
+    except redis.RedisError:
+        pass
+
+async def rebuild_license_filter(load_licenses):
+    """
+    Rebuild the filter from the database and swap it in atomically.
+    load_licenses: async callable returning (license_key, active) rows.
+    """
+    global _license_loader
+    _license_loader = load_licenses
+    if redis_client is None:
+        return
+    try:
+        # one worker builds; the others keep the old filter until it is renamed in
+        if not await redis_client.set(LICENSE_FILTER_LOCK_KEY, 1, nx=True, ex=300):
+            return
+        # inserts failing from here on re-mark the filter dirty after the swap
+        was_dirty = await redis_client.getdel(LICENSE_FILTER_DIRTY_KEY)
+    except redis.RedisError:
+        return  # lookups keep failing open or using the old filter
+    built = False
+    try:
+        await redis_client.delete(LICENSE_FILTER_BUILD_KEY)
+        await redis_client.execute_command(
+            "BF.RESERVE", LICENSE_FILTER_BUILD_KEY, LICENSE_FILTER_ERROR_RATE, LICENSE_FILTER_CAPACITY
+        )
+        rows = await load_licenses()
+        keys = [key for key, _ in rows]
+        killed = [key for key, active in rows if not active]
+        for i in range(0, len(keys), FILTER_BATCH):
+            await redis_client.execute_command(
+                "BF.INSERT", LICENSE_FILTER_BUILD_KEY, "NOCREATE", "ITEMS", *keys[i:i + FILTER_BATCH]
+            )
+        for i in range(0, len(killed), FILTER_BATCH):
+            await redis_client.sadd(KILLED_KEYS_SET, *killed[i:i + FILTER_BATCH])
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.rename(LICENSE_FILTER_BUILD_KEY, LICENSE_FILTER_KEY)
+            pipe.expire(LICENSE_FILTER_KEY, LICENSE_FILTER_MAX_AGE)
+            await pipe.execute()
+        built = True
+    except Exception:
+        # Redis or database failure (e.g. DB unreachable, migrations not run):
+        # the filter is optional, so never let it block startup
+        pass
+    finally:
+        if was_dirty and not built:
+            await _mark_filter_dirty()
+        try:
+            await redis_client.delete(LICENSE_FILTER_BUILD_KEY, LICENSE_FILTER_LOCK_KEY)
+        except redis.RedisError:
+            pass
@@ -1,14 +1,27 @@
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app.routes import admin as admin_router
 from app.routes import licenses as license_router
-from app.models import Base
-from app.database import engine
+from sqlalchemy import select
+from app.cache import rebuild_license_filter
+from app.models import License
+from app.database import AsyncSessionLocal
 
-# create tables if not present (on startup)
-Base.metadata.create_all(bind=engine)
+# schema is managed by alembic (`alembic upgrade head` before starting workers)
 
-app = FastAPI(title="PhoneTool License Server")
+async def load_license_keys():
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(select(License.license_key, License.active))
+        return rows.all()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await rebuild_license_filter(load_license_keys)
+    yield
+
+app = FastAPI(title="PhoneTool License Server", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(admin_router.router)
 app.include_router(license_router.router)
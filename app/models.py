@@ -1,5 +1,5 @@
 # app/models.py
-from sqlalchemy import Column, Integer, Text, Boolean, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Text, Boolean, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -20,12 +20,17 @@ class License(Base):
     owner = Column(Text, nullable=True)
     plan = Column(Text, nullable=True)
     expires_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at_epoch = Column(BigInteger, nullable=True)  # unix seconds, same instant as expires_at
     max_activations = Column(Integer, default=1)
     active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Activation(Base):
     __tablename__ = "activations"
+    # serves both the per-device lookup and COUNT(*) per license (leading column)
+    __table_args__ = (
+        Index("ix_activations_license_device", "license_id", "device_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     license_id = Column(Integer, nullable=False)  # FK not declared for portability
     device_id = Column(Text, nullable=True)
@@ -1,46 +1,69 @@
 # app/routes/admin.py
-from fastapi import APIRouter, HTTPException, Header, status, Depends
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Header, status, Depends, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, func
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime, timedelta, timezone
+import hmac
 import secrets
+import orjson
 import os
 
-from app.database import SessionLocal
+from app.cache import (
+    ADMIN_LIST_CACHE_KEY,
+    ADMIN_LIST_CACHE_TTL,
+    add_license_keys,
+    expire_cached_response,
+    get_cached_response,
+    invalidate_license,
+    mark_license_killed,
+    set_cached_response,
+)
+from app.database import AsyncSessionLocal
 from app.models import License, Plan, Activation, Base
 from app.utils.crypto import generate_license_key
 
 ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", None)
 if not ADMIN_TOKEN:
     raise RuntimeError("ADMIN_TOKEN env var must be set")
+ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode()
+
+MAX_BULK_LICENSES = 10000
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    db = AsyncSessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
 
 def verify_admin(token: str | None):
-    if token != ADMIN_TOKEN:
+    # constant-time compare: no early exit on the first differing byte
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN_BYTES):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-@router.post("/create_license")
-def create_license(owner: str, duration_plan: str = "lifetime", max_activations: int = 1, x_admin_token: str | None = Header(None), db: Session = Depends(get_db)):
-    verify_admin(x_admin_token)
+def license_expiry(duration_plan: str) -> tuple[datetime | None, int | None]:
     # compute expiry
     expires_at = None
     if duration_plan == "1month":
-        expires_at = datetime.utcnow() + timedelta(days=30)
+        expires_at = datetime.now(timezone.utc) + timedelta(days=30)
     elif duration_plan == "3months":
-        expires_at = datetime.utcnow() + timedelta(days=90)
+        expires_at = datetime.now(timezone.utc) + timedelta(days=90)
     elif duration_plan == "6months":
-        expires_at = datetime.utcnow() + timedelta(days=180)
+        expires_at = datetime.now(timezone.utc) + timedelta(days=180)
     elif duration_plan == "lifetime":
         expires_at = None
     else:
         raise HTTPException(status_code=400, detail="Unknown duration_plan")
+    expires_at_epoch = int(expires_at.timestamp()) if expires_at else None
+    return expires_at, expires_at_epoch
+
+@router.post("/create_license")
+async def create_license(owner: str, duration_plan: str = "lifetime", max_activations: int = 1, x_admin_token: str | None = Header(None), db: AsyncSession = Depends(get_db)):
+    verify_admin(x_admin_token)
+    expires_at, expires_at_epoch = license_expiry(duration_plan)
 
     key = generate_license_key()
     lic = License(
@@ -48,39 +71,95 @@ def create_license(owner: str, duration_plan: str = "lifetime", max_activations:
         owner=owner,
         plan=duration_plan,
         expires_at=expires_at,
+        expires_at_epoch=expires_at_epoch,
         max_activations=max_activations,
         active=True
     )
     db.add(lic)
-    db.commit()
-    db.refresh(lic)
-    return {"license_key": lic.license_key, "expires_at": lic.expires_at.isoformat() if lic.expires_at else None, "max_activations": lic.max_activations}
+    await db.commit()
+    await db.refresh(lic)
+    await add_license_keys([lic.license_key])
+    await expire_cached_response(ADMIN_LIST_CACHE_KEY)
+    return {"license_key": lic.license_key, "expires_at": lic.expires_at.isoformat() if lic.expires_at else None, "expires_at_epoch": lic.expires_at_epoch, "max_activations": lic.max_activations}
+
+@router.post("/create_licenses_bulk")
+async def create_licenses_bulk(owner: str, n: int, duration_plan: str = "lifetime", max_activations: int = 1, x_admin_token: str | None = Header(None), db: AsyncSession = Depends(get_db)):
+    verify_admin(x_admin_token)
+    if n < 1 or n > MAX_BULK_LICENSES:
+        raise HTTPException(status_code=400, detail=f"n must be between 1 and {MAX_BULK_LICENSES}")
+    expires_at, expires_at_epoch = license_expiry(duration_plan)
+
+    keys = [generate_license_key() for _ in range(n)]
+    # one multi-row INSERT and one commit for the whole batch
+    await db.execute(insert(License), [
+        {
+            "license_key": key,
+            "owner": owner,
+            "plan": duration_plan,
+            "expires_at": expires_at,
+            "expires_at_epoch": expires_at_epoch,
+            "max_activations": max_activations,
+            "active": True,
+        }
+        for key in keys
+    ])
+    await db.commit()
+    await add_license_keys(keys)
+    await expire_cached_response(ADMIN_LIST_CACHE_KEY)
+    return {"license_keys": keys, "expires_at": expires_at.isoformat() if expires_at else None, "expires_at_epoch": expires_at_epoch, "max_activations": max_activations}
 
 @router.post("/kill_license")
-def kill_license(license_key: str, x_admin_token: str | None = Header(None), db: Session = Depends(get_db)):
+async def kill_license(license_key: str, x_admin_token: str | None = Header(None), db: AsyncSession = Depends(get_db)):
     verify_admin(x_admin_token)
-    lic = db.query(License).filter(License.license_key == license_key).first()
+    lic = await db.scalar(select(License).where(License.license_key == license_key))
     if not lic:
         raise HTTPException(status_code=404, detail="License not found")
     lic.active = False
-    db.add(lic)
-    db.commit()
+    await db.commit()
+    await mark_license_killed(license_key)
+    await invalidate_license(license_key)
+    await expire_cached_response(ADMIN_LIST_CACHE_KEY)
     return {"ok": True}
 
 @router.get("/list_licenses")
-def list_licenses(x_admin_token: str | None = Header(None), db: Session = Depends(get_db)):
+async def list_licenses(x_admin_token: str | None = Header(None), db: AsyncSession = Depends(get_db)):
     verify_admin(x_admin_token)
-    items = db.query(License).all()
+    cached = await get_cached_response(ADMIN_LIST_CACHE_KEY)
+    if cached and cached[1]:
+        return Response(content=cached[0], media_type="application/json")
+
+    # single round trip: only the listed columns, outer-joined to activation counts
+    try:
+        rows = await db.execute(
+            select(
+                License.license_key,
+                License.owner,
+                License.plan,
+                License.expires_at,
+                License.expires_at_epoch,
+                License.active,
+                func.count(Activation.id),
+            )
+            .outerjoin(Activation, Activation.license_id == License.id)
+            .group_by(License.id)
+            .order_by(License.id)
+        )
+    except (SQLAlchemyError, OSError):
+        if cached:
+            # database unavailable: serve the last snapshot, however stale
+            return Response(content=cached[0], media_type="application/json")
+        raise
     out = []
-    for lic in items:
-        # get activations count
-        act_count = db.query(Activation).filter(Activation.license_id == lic.id).count()
+    for license_key, owner, plan, expires_at, expires_at_epoch, active, act_count in rows:
         out.append({
-            "license_key": lic.license_key,
-            "owner": lic.owner,
-            "plan": lic.plan,
-            "expires_at": lic.expires_at.isoformat() if lic.expires_at else None,
-            "active": lic.active,
+            "license_key": license_key,
+            "owner": owner,
+            "plan": plan,
+            "expires_at": expires_at.isoformat() if expires_at else None,
+            "expires_at_epoch": expires_at_epoch,
+            "active": active,
             "activations": act_count
         })
-    return {"licenses": out}
+    body = orjson.dumps({"licenses": out})
+    await set_cached_response(ADMIN_LIST_CACHE_KEY, body, ADMIN_LIST_CACHE_TTL)
+    return Response(content=body, media_type="application/json")
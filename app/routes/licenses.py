@@ -1,26 +1,81 @@
 # app/routes/licenses.py
 from fastapi import APIRouter, HTTPException, status, Depends, Request
-from sqlalchemy.orm import Session
-from datetime import datetime
-from app.database import SessionLocal
+from sqlalchemy import select, func, and_, false
+from sqlalchemy.ext.asyncio import AsyncSession
+import time
+from datetime import datetime, timezone
+from app.cache import check_license_filter, get_cached_license, set_cached_license
+from app.database import AsyncSessionLocal
 from app.models import License, Activation
 from app.utils.crypto import sign_activation, verify_activation_token
 
 router = APIRouter(prefix="/license", tags=["license"])
 
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    db = AsyncSessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+def license_snapshot(lic: License) -> dict:
+    # plain, JSON-able view of a license row; this is what gets cached
+    expires_at_epoch = lic.expires_at_epoch
+    if expires_at_epoch is None and lic.expires_at:
+        # row written without the epoch column: derive it once, here
+        expires_at = lic.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        expires_at_epoch = int(expires_at.timestamp())
+    return {
+        "id": lic.id,
+        "license_key": lic.license_key,
+        "owner": lic.owner,
+        "plan": lic.plan,
+        "expires_at": lic.expires_at.isoformat() if lic.expires_at else None,
+        "expires_at_epoch": expires_at_epoch,
+        "active": lic.active,
+        "max_activations": lic.max_activations,
+    }
+
+def device_activation_clause(device_id: str | None):
+    if not device_id:
+        return false()
+    return and_(Activation.license_id == License.id, Activation.device_id == device_id)
+
+async def load_license(db: AsyncSession, license_key: str, device_id: str | None) -> tuple[dict | None, Activation | None]:
+    """
+    Return (license snapshot, this device's activation or None).
+    On a cache miss both come from one outer-joined query.
+    """
+    lic = await get_cached_license(license_key)
+    if lic is not None:
+        existing = None
+        if device_id and lic["active"]:
+            existing = await db.scalar(select(Activation).where(Activation.license_id == lic["id"], Activation.device_id == device_id).limit(1))
+        return lic, existing
+    row = (await db.execute(
+        select(License, Activation)
+        .outerjoin(Activation, device_activation_clause(device_id))
+        .where(License.license_key == license_key)
+        .limit(1)
+    )).first()
+    if not row:
+        return None, None
+    lic = license_snapshot(row[0])
+    await set_cached_license(license_key, lic)
+    return lic, row[1]
+
+def is_expired(lic: dict) -> bool:
+    expires_at_epoch = lic.get("expires_at_epoch")
+    return expires_at_epoch is not None and expires_at_epoch < int(time.time())
 
 class ActivateRequest:
     # used only by type hints, request parsing in FastAPI will parse body dict
     pass
 
 @router.post("/activate")
-def activate_license(payload: dict, db: Session = Depends(get_db), request: Request = None):
+async def activate_license(payload: dict, db: AsyncSession = Depends(get_db), request: Request = None):
     """
     Expected JSON body:
     {
@@ -36,32 +91,43 @@ def activate_license(payload: dict, db: Session = Depends(get_db), request: Requ
     if not license_key:
         raise HTTPException(status_code=400, detail="license_key required")
 
-    lic = db.query(License).filter(License.license_key == license_key).first()
+    # reject unknown and killed keys without touching the database
+    may_exist, killed = await check_license_filter(license_key)
+    if not may_exist:
+        return {"valid": False, "message": "License not found"}
+    if killed:
+        return {"valid": False, "message": "License disabled"}
+
+    lic, existing = await load_license(db, license_key, device_id)
     if not lic:
         return {"valid": False, "message": "License not found"}
 
-    if not lic.active:
+    if not lic["active"]:
         return {"valid": False, "message": "License disabled"}
 
     # expiry check
-    if lic.expires_at and lic.expires_at < datetime.utcnow():
+    if is_expired(lic):
         return {"valid": False, "message": "License expired"}
 
-    # existing activation by device
-    existing = None
-    if device_id:
-        existing = db.query(Activation).filter(Activation.license_id == lic.id, Activation.device_id == device_id).first()
+    if not existing:
+        # the license row lock serializes concurrent activations of one license
+        # until commit. Statements after it see rows committed by whoever held
+        # the lock before us, so re-check the device (it may have just been
+        # activated by a concurrent request) and count separately.
+        await db.execute(select(License.id).where(License.id == lic["id"]).with_for_update())
+        if device_id:
+            existing = await db.scalar(select(Activation).where(Activation.license_id == lic["id"], Activation.device_id == device_id).limit(1))
 
+    # existing activation by device
     if existing:
-        existing.last_seen = datetime.utcnow()
-        db.add(existing)
-        db.commit()
-        token = sign_activation(lic.license_key, device_id)
-        return {"valid": True, "message": "OK", "activation_token": token, "license": {"key": lic.license_key, "owner": lic.owner, "plan": lic.plan, "expires_at": lic.expires_at.isoformat() if lic.expires_at else None}}
+        existing.last_seen = datetime.now(timezone.utc)
+        await db.commit()
+        token = sign_activation(lic["license_key"], device_id)
+        return {"valid": True, "message": "OK", "activation_token": token, "license": {"key": lic["license_key"], "owner": lic["owner"], "plan": lic["plan"], "expires_at": lic["expires_at"], "expires_at_epoch": lic.get("expires_at_epoch")}}
 
     # enforce max activations
-    act_count = db.query(Activation).filter(Activation.license_id == lic.id).count()
-    max_act = lic.max_activations or 0
+    act_count = await db.scalar(select(func.count(Activation.id)).where(Activation.license_id == lic["id"]))
+    max_act = lic["max_activations"] or 0
     if max_act > 0 and act_count >= max_act:
         return {"valid": False, "message": "Activation limit reached"}
 
@@ -70,16 +136,15 @@ def activate_license(payload: dict, db: Session = Depends(get_db), request: Requ
     if request:
         ip = request.client.host if request.client else None
 
-    a = Activation(license_id=lic.id, device_id=device_id or "unknown", device_fingerprint=device_fingerprint, ip=ip, last_seen=datetime.utcnow())
+    a = Activation(license_id=lic["id"], device_id=device_id or "unknown", device_fingerprint=device_fingerprint, ip=ip, last_seen=datetime.now(timezone.utc))
     db.add(a)
-    db.commit()
-    db.refresh(a)
+    await db.commit()
 
-    token = sign_activation(lic.license_key, device_id)
-    return {"valid": True, "message": "Activated", "activation_token": token, "license": {"key": lic.license_key, "owner": lic.owner, "plan": lic.plan, "expires_at": lic.expires_at.isoformat() if lic.expires_at else None}}
+    token = sign_activation(lic["license_key"], device_id)
+    return {"valid": True, "message": "Activated", "activation_token": token, "license": {"key": lic["license_key"], "owner": lic["owner"], "plan": lic["plan"], "expires_at": lic["expires_at"], "expires_at_epoch": lic.get("expires_at_epoch")}}
 
 @router.post("/verify_token")
-def verify_token(payload: dict):
+async def verify_token(payload: dict):
     token = payload.get("activation_token")
     if not token:
         raise HTTPException(status_code=400, detail="activation_token required")
@@ -1,30 +1,51 @@
 # app/utils/crypto.py
 import os
 import hmac
-import hashlib
 import base64
 import secrets
-from datetime import datetime
+import time
 
 ACTIVATION_SECRET = os.environ.get("ACTIVATION_SECRET", None)
 if not ACTIVATION_SECRET:
     raise RuntimeError("ACTIVATION_SECRET env var must be set")
 
+ACTIVATION_SECRET_BYTES = ACTIVATION_SECRET.encode()
+
 def generate_license_key():
     # human-friendly but random
     return secrets.token_urlsafe(16)
 
 def sign_activation(license_key: str, device_id: str | None) -> str:
-    payload = f"{license_key}|{device_id or ''}|{int(datetime.utcnow().timestamp())}"
-    sig = hmac.new(ACTIVATION_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
-    token = base64.urlsafe_b64encode(payload.encode() + b"~" + sig).decode()
+    payload = b"|".join((license_key.encode(), (device_id or "").encode(), b"%d" % time.time()))
+    sig = hmac.digest(ACTIVATION_SECRET_BYTES, payload, "sha256")
+    token = base64.urlsafe_b64encode(payload + b"~" + sig).decode()
     return token
 
+# Verification is pure and clients present the same token repeatedly, so
+# successful verifications are memoized (oldest evicted first). Failures are
+# not cached and oversized tokens are rejected up front, so garbage sent to the
+# unauthenticated endpoint cannot pin memory.
+MAX_ACTIVATION_TOKEN_LENGTH = 2048
+VERIFIED_TOKEN_CACHE_SIZE = 8192
+_verified_tokens: dict[str, None] = {}
+
 def verify_activation_token(token: str) -> bool:
+    if not isinstance(token, str) or len(token) > MAX_ACTIVATION_TOKEN_LENGTH:
+        return False
+    if token in _verified_tokens:
+        return True
+    ok = _verify_activation_token(token)
+    if ok:
+        if len(_verified_tokens) >= VERIFIED_TOKEN_CACHE_SIZE:
+            _verified_tokens.pop(next(iter(_verified_tokens)))
+        _verified_tokens[token] = None
+    return ok
+
+def _verify_activation_token(token: str) -> bool:
     try:
         raw = base64.urlsafe_b64decode(token.encode())
         payload, sig = raw.rsplit(b"~", 1)
-        expected = hmac.new(ACTIVATION_SECRET.encode(), payload, hashlib.sha256).digest()
+        expected = hmac.digest(ACTIVATION_SECRET_BYTES, payload, "sha256")
         return hmac.compare_digest(expected, sig)
     except Exception:
         return False
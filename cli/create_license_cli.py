@@ -2,14 +2,23 @@
 # Local CLI to create and deactivate licenses (uses DB directly)
 import os
 import argparse
-from datetime import datetime, timedelta
-from app.database import SessionLocal
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from app.cache import (
+    ADMIN_LIST_CACHE_KEY,
+    add_license_keys,
+    expire_cached_response,
+    invalidate_license,
+    mark_license_killed,
+)
+from app.database import AsyncSessionLocal, engine
 from app.models import License
 from app.utils.crypto import generate_license_key
 
-def create_license(owner: str, plan: str, duration_plan: str, max_activations: int):
+async def create_license(owner: str, plan: str, duration_plan: str, max_activations: int):
     expiry = None
-    now = datetime.utcnow()
+    now = datetime.now(timezone.utc)
     if duration_plan == "1month":
         expiry = now + timedelta(days=30)
     elif duration_plan == "3months":
@@ -20,32 +29,37 @@ def create_license(owner: str, plan: str, duration_plan: str, max_activations: i
         expiry = None
     else:
         raise ValueError("Unknown duration_plan")
+    expiry_epoch = int(expiry.timestamp()) if expiry else None
 
     key = generate_license_key()
-    db = SessionLocal()
-    try:
-        lic = License(license_key=key, owner=owner, plan=plan, expires_at=expiry, max_activations=max_activations, active=True)
+    async with AsyncSessionLocal() as db:
+        lic = License(license_key=key, owner=owner, plan=plan, expires_at=expiry, expires_at_epoch=expiry_epoch, max_activations=max_activations, active=True)
         db.add(lic)
-        db.commit()
-        db.refresh(lic)
+        await db.commit()
+        await db.refresh(lic)
+        await add_license_keys([lic.license_key])
+        await expire_cached_response(ADMIN_LIST_CACHE_KEY)
         print("License created:", lic.license_key)
         print("Expires at:", lic.expires_at)
-    finally:
-        db.close()
 
-def deactivate_license(license_key: str):
-    db = SessionLocal()
-    try:
-        lic = db.query(License).filter(License.license_key == license_key).first()
+async def deactivate_license(license_key: str):
+    async with AsyncSessionLocal() as db:
+        lic = await db.scalar(select(License).where(License.license_key == license_key))
         if not lic:
             print("License not found")
             return
         lic.active = False
-        db.add(lic)
-        db.commit()
+        await db.commit()
+        await mark_license_killed(license_key)
+        await invalidate_license(license_key)
+        await expire_cached_response(ADMIN_LIST_CACHE_KEY)
         print("License deactivated:", license_key)
+
+async def _run(coro):
+    try:
+        await coro
     finally:
-        db.close()
+        await engine.dispose()
 
 def main():
     parser = argparse.ArgumentParser()
@@ -62,12 +76,12 @@ def main():
         if not args.owner:
             print("owner required for create")
             return
-        create_license(owner=args.owner, plan=args.plan, duration_plan=args.duration, max_activations=args.max)
+        asyncio.run(_run(create_license(owner=args.owner, plan=args.plan, duration_plan=args.duration, max_activations=args.max)))
     else:
         if not args.key:
             print("key required for deactivate")
             return
-        deactivate_license(args.key)
+        asyncio.run(_run(deactivate_license(args.key)))
 
 if __name__ == "__main__":
     main()
@@ -1,18 +1,20 @@
 # server/main.py
 # FastAPI license server that uses Supabase REST API (service role key)
-# Requirements: fastapi, uvicorn, requests, python-dotenv
+# Requirements: fastapi, uvicorn, httpx[http2], python-dotenv
 # Run with: uvicorn server.main:app --host 0.0.0.0 --port 8000
 
 import os
 import secrets
 import hmac
-import hashlib
 import base64
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
 from typing import Optional, List
 
-import requests
+import httpx
 from fastapi import FastAPI, HTTPException, Header, status
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # ---------------------------
@@ -24,6 +26,9 @@ ACTIVATION_SECRET = os.environ.get("ACTIVATION_SECRET", "CHANGE_ME_ACTIVATION_SE
 if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
     raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in environment")
 
+ACTIVATION_SECRET_BYTES = ACTIVATION_SECRET.encode()
+ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode()
+
 REST_HEADERS = {
     "apikey": SUPABASE_SERVICE_KEY,
     "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
@@ -33,8 +38,35 @@ REST_HEADERS = {
 # Supabase table names (you will create them; SQL below)
 LICENSES_TABLE = "licenses"
 ACTIVATIONS_TABLE = "activations"
-
-app = FastAPI(title="PhoneTool License Server (Supabase)")
+# /api/check and /admin/list_licenses embed activations in the license query
+# (PostgREST resource embedding), which requires a declared foreign key;
+# without it both endpoints fail with a Supabase error:
+#   alter table activations add constraint activations_license_id_fkey
+#     foreign key (license_id) references licenses (id) on delete cascade;
+# licenses also needs the epoch expiry used by /api/check:
+#   alter table licenses add column expires_at_epoch bigint;
+#   update licenses set expires_at_epoch = extract(epoch from expires_at)::bigint where expires_at is not null;
+
+# Shared Supabase client: keep-alive connections + HTTP/2, opened once per process
+http_client: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    # retries cover connection failures only (e.g. a pooled connection
+    # dropped by the server), never requests that already got a response
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        retries=2,
+    )
+    http_client = httpx.AsyncClient(headers=REST_HEADERS, transport=transport, timeout=8)
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+
+app = FastAPI(title="PhoneTool License Server (Supabase)", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # ---------------------------
 # Pydantic models
@@ -51,56 +83,51 @@ class CheckResponse(BaseModel):
 
 # ---------------------------
 # Helpers: Supabase REST calls
-def supabase_get_license_row(license_key: str) -> Optional[dict]:
-    """Return license row or None"""
+async def supabase_get_license_row(license_key: str, with_activations: bool = False) -> Optional[dict]:
+    """Return license row or None; optionally with its activations embedded"""
     url = f"{SUPABASE_URL}/rest/v1/{LICENSES_TABLE}"
-    params = {"select": "*", "key": f"eq.{license_key}"}
-    r = requests.get(url, headers=REST_HEADERS, params=params, timeout=8)
+    select = f"*,{ACTIVATIONS_TABLE}(*)" if with_activations else "*"
+    params = {"select": select, "key": f"eq.{license_key}"}
+    r = await http_client.get(url, params=params)
     if r.status_code != 200:
         raise HTTPException(status_code=500, detail="Supabase error")
     rows = r.json()
     return rows[0] if rows else None
 
-def supabase_create_license_row(key: str, owner: str, plan: str, expires_at: Optional[str], max_activations: int) -> dict:
+async def supabase_create_license_row(key: str, owner: str, plan: str, expires_at: Optional[str], max_activations: int, expires_at_epoch: Optional[int] = None) -> dict:
     url = f"{SUPABASE_URL}/rest/v1/{LICENSES_TABLE}"
     payload = {
         "key": key,
         "owner": owner,
         "plan": plan,
         "expires_at": expires_at,
+        "expires_at_epoch": expires_at_epoch,
         "max_activations": max_activations,
         "active": True,
         "created_at": datetime.utcnow().isoformat()
     }
-    r = requests.post(url, headers=REST_HEADERS, json=payload, timeout=8)
+    r = await http_client.post(url, json=payload)
     if r.status_code not in (201, 200):
         raise HTTPException(status_code=500, detail=f"Supabase create failed: {r.text}")
     return r.json()
 
-def supabase_disable_license_row(license_key: str) -> bool:
+async def supabase_disable_license_row(license_key: str) -> bool:
     url = f"{SUPABASE_URL}/rest/v1/{LICENSES_TABLE}"
     params = {"key": f"eq.{license_key}"}
     payload = {"active": False}
-    r = requests.patch(url, headers=REST_HEADERS, params=params, json=payload, timeout=8)
+    r = await http_client.patch(url, params=params, json=payload)
     return r.status_code in (200, 204)
 
-def supabase_list_licenses() -> List[dict]:
+async def supabase_list_licenses() -> List[dict]:
+    """Return all license rows with their activations embedded (one request)"""
     url = f"{SUPABASE_URL}/rest/v1/{LICENSES_TABLE}"
-    params = {"select": "*"}
-    r = requests.get(url, headers=REST_HEADERS, params=params, timeout=8)
+    params = {"select": f"*,{ACTIVATIONS_TABLE}(device_id,last_seen)"}
+    r = await http_client.get(url, params=params)
     if r.status_code != 200:
         raise HTTPException(status_code=500, detail="Supabase error listing")
     return r.json()
 
-def supabase_get_activations_for_license(license_id: int) -> List[dict]:
-    url = f"{SUPABASE_URL}/rest/v1/{ACTIVATIONS_TABLE}"
-    params = {"select": "*", "license_id": f"eq.{license_id}"}
-    r = requests.get(url, headers=REST_HEADERS, params=params, timeout=8)
-    if r.status_code != 200:
-        raise HTTPException(status_code=500, detail="Supabase error activations")
-    return r.json()
-
-def supabase_create_activation_row(license_id: int, device_id: str, device_fingerprint: Optional[str], ip: Optional[str]) -> dict:
+async def supabase_create_activation_row(license_id: int, device_id: str, device_fingerprint: Optional[str], ip: Optional[str]) -> dict:
     url = f"{SUPABASE_URL}/rest/v1/{ACTIVATIONS_TABLE}"
     payload = {
         "license_id": license_id,
@@ -110,52 +137,54 @@ def supabase_create_activation_row(license_id: int, device_id: str, device_finge
         "last_seen": datetime.utcnow().isoformat(),
         "created_at": datetime.utcnow().isoformat()
     }
-    r = requests.post(url, headers=REST_HEADERS, json=payload, timeout=8)
+    r = await http_client.post(url, json=payload)
     if r.status_code not in (201,200):
         raise HTTPException(status_code=500, detail=f"Supabase create activation failed: {r.text}")
     return r.json()
 
-def supabase_update_activation_last_seen(activation_id: int):
+async def supabase_update_activation_last_seen(activation_id: int):
     url = f"{SUPABASE_URL}/rest/v1/{ACTIVATIONS_TABLE}"
     params = {"id": f"eq.{activation_id}"}
     payload = {"last_seen": datetime.utcnow().isoformat()}
-    r = requests.patch(url, headers=REST_HEADERS, params=params, json=payload, timeout=8)
+    r = await http_client.patch(url, params=params, json=payload)
     return r.status_code in (200,204)
 
 # ---------------------------
 # Activation token signing (HMAC)
 def sign_activation(license_key: str, device_id: Optional[str]) -> str:
-    payload = f"{license_key}|{device_id if device_id else ''}|{int(datetime.utcnow().timestamp())}"
-    sig = hmac.new(ACTIVATION_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
-    token = base64.urlsafe_b64encode(payload.encode() + b"~" + sig).decode()
+    payload = b"|".join((license_key.encode(), (device_id or "").encode(), b"%d" % time.time()))
+    sig = hmac.digest(ACTIVATION_SECRET_BYTES, payload, "sha256")
+    token = base64.urlsafe_b64encode(payload + b"~" + sig).decode()
     return token
 
 # ---------------------------
 # Endpoints
 @app.post("/api/check", response_model=CheckResponse)
-def api_check(req: CheckRequest):
-    # 1) lookup license
-    lic = supabase_get_license_row(req.license_key)
+async def api_check(req: CheckRequest):
+    # 1) lookup license, activations embedded in the same request
+    lic = await supabase_get_license_row(req.license_key, with_activations=True)
     if not lic:
         return CheckResponse(valid=False, message="License not found")
 
     if not lic.get("active", True):
         return CheckResponse(valid=False, message="License disabled")
 
-    expires_at = lic.get("expires_at")
-    if expires_at:
-        # ISO string stored in Supabase
+    expires_at_epoch = lic.get("expires_at_epoch")
+    if expires_at_epoch is None and lic.get("expires_at"):
+        # rows created before expires_at_epoch existed: parse the ISO string
         try:
-            exp_dt = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
-            if exp_dt < datetime.utcnow():
-                return CheckResponse(valid=False, message="License expired")
+            exp_dt = datetime.fromisoformat(lic["expires_at"].replace("Z", "+00:00"))
+            if exp_dt.tzinfo is None:
+                exp_dt = exp_dt.replace(tzinfo=timezone.utc)
+            expires_at_epoch = int(exp_dt.timestamp())
         except Exception:
             pass
+    if expires_at_epoch is not None and expires_at_epoch < int(time.time()):
+        return CheckResponse(valid=False, message="License expired")
 
     license_id = lic["id"]
 
-    # fetch activations for license
-    activations = supabase_get_activations_for_license(license_id)
+    activations = lic.get(ACTIVATIONS_TABLE) or []
 
     # if device_id provided and exists, update last_seen and return OK
     existing = None
@@ -166,13 +195,14 @@ def api_check(req: CheckRequest):
                 break
 
     if existing:
-        supabase_update_activation_last_seen(existing["id"])
+        await supabase_update_activation_last_seen(existing["id"])
         token = sign_activation(lic["key"], req.device_id)
         return CheckResponse(valid=True, message="OK", license={
             "key": lic["key"],
             "owner": lic.get("owner"),
             "plan": lic.get("plan"),
-            "expires_at": lic.get("expires_at")
+            "expires_at": lic.get("expires_at"),
+            "expires_at_epoch": expires_at_epoch
         }, activation_token=token)
 
     # New activation: enforce max_activations
@@ -181,23 +211,25 @@ def api_check(req: CheckRequest):
         return CheckResponse(valid=False, message="Activation limit reached")
 
     # create new activation row
-    created = supabase_create_activation_row(license_id=license_id, device_id=req.device_id or "unknown", device_fingerprint=req.device_fingerprint, ip=None)
+    created = await supabase_create_activation_row(license_id=license_id, device_id=req.device_id or "unknown", device_fingerprint=req.device_fingerprint, ip=None)
     token = sign_activation(lic["key"], req.device_id)
     return CheckResponse(valid=True, message="Activated", license={
         "key": lic["key"],
         "owner": lic.get("owner"),
         "plan": lic.get("plan"),
-        "expires_at": lic.get("expires_at")
+        "expires_at": lic.get("expires_at"),
+        "expires_at_epoch": expires_at_epoch
     }, activation_token=token)
 
 # ---------------------------
 # Admin endpoints (require ADMIN_TOKEN header)
 def verify_admin(token: Optional[str]):
-    if token != ADMIN_TOKEN:
+    # constant-time compare: no early exit on the first differing byte
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN_BYTES):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
 @app.post("/admin/create_license")
-def admin_create_license(owner: str, plan: str = "lifetime", duration_plan: str = "lifetime", max_activations: int = 1, x_admin_token: Optional[str] = Header(None)):
+async def admin_create_license(owner: str, plan: str = "lifetime", duration_plan: str = "lifetime", max_activations: int = 1, x_admin_token: Optional[str] = Header(None)):
     """
     Create a new license.
       - plan: 'lifetime' or '1month'/'3months'/'6months' (for record)
@@ -206,44 +238,47 @@ def admin_create_license(owner: str, plan: str = "lifetime", duration_plan: str
     verify_admin(x_admin_token)
 
     # compute expiry based on duration_plan
-    expires_at = None
+    expires_dt = None
     if duration_plan == "1month":
-        expires_at = (datetime.utcnow() + timedelta(days=30)).isoformat()
+        expires_dt = datetime.utcnow() + timedelta(days=30)
     elif duration_plan == "3months":
-        expires_at = (datetime.utcnow() + timedelta(days=90)).isoformat()
+        expires_dt = datetime.utcnow() + timedelta(days=90)
     elif duration_plan == "6months":
-        expires_at = (datetime.utcnow() + timedelta(days=180)).isoformat()
+        expires_dt = datetime.utcnow() + timedelta(days=180)
     elif duration_plan == "lifetime":
-        expires_at = None
+        expires_dt = None
     else:
         # unknown -> no expiry
-        expires_at = None
+        expires_dt = None
+    expires_at = expires_dt.isoformat() if expires_dt else None
+    expires_at_epoch = int(expires_dt.replace(tzinfo=timezone.utc).timestamp()) if expires_dt else None
 
     key = secrets.token_urlsafe(16)
-    row = supabase_create_license_row(key=key, owner=owner, plan=plan, expires_at=expires_at, max_activations=max_activations)
-    return {"license_key": row.get("key"), "owner": owner, "expires_at": expires_at}
+    row = await supabase_create_license_row(key=key, owner=owner, plan=plan, expires_at=expires_at, max_activations=max_activations, expires_at_epoch=expires_at_epoch)
+    return {"license_key": row.get("key"), "owner": owner, "expires_at": expires_at, "expires_at_epoch": expires_at_epoch}
 
 @app.post("/admin/kill_license")
-def admin_kill_license(license_key: str, x_admin_token: Optional[str] = Header(None)):
+async def admin_kill_license(license_key: str, x_admin_token: Optional[str] = Header(None)):
     verify_admin(x_admin_token)
-    ok = supabase_disable_license_row(license_key)
+    ok = await supabase_disable_license_row(license_key)
     if not ok:
         raise HTTPException(status_code=404, detail="License not found or could not disable")
     return {"ok": True}
 
 @app.get("/admin/list_licenses")
-def admin_list(x_admin_token: Optional[str] = Header(None)):
+async def admin_list(x_admin_token: Optional[str] = Header(None)):
     verify_admin(x_admin_token)
-    licenses = supabase_list_licenses()
-    # augment with activations
+    licenses = await supabase_list_licenses()
+    # activations come embedded via PostgREST resource embedding
     out = []
     for lic in licenses:
-        acts = supabase_get_activations_for_license(lic["id"])
+        acts = lic.get(ACTIVATIONS_TABLE) or []
         out.append({
             "key": lic["key"],
             "owner": lic.get("owner"),
             "plan": lic.get("plan"),
             "expires_at": lic.get("expires_at"),
+            "expires_at_epoch": lic.get("expires_at_epoch"),
             "active": lic.get("active"),
             "activations": [{"device_id": a.get("device_id"), "last_seen": a.get("last_seen")} for a in acts]
         })